@@ -6,17 +6,18 @@ A web interface for the calculator agent using Streamlit.
 
 import os
 import sys
+import hashlib
+from collections import deque
+from itertools import islice
 import streamlit as st
 from dotenv import load_dotenv
-import io
-import contextlib
-import re
 
 # Add the project directory to the Python path
 sys.path.insert(0, os.path.abspath('.'))
 
 # Import the orchestrator
 from src.orchestrator import CalculatorOrchestrator
+from src.agents.utility import canonicalize
 
 # Page config
 st.set_page_config(
@@ -29,8 +30,11 @@ st.set_page_config(
 # Load environment variables
 load_dotenv()
 
-# Custom CSS
-st.markdown("""
+# Maximum number of calculations kept in the session history
+MAX_HISTORY = 20
+
+# Custom CSS. Streamlit drops elements that a rerun does not emit, so this is re-emitted on every run.
+CUSTOM_CSS = """
 <style>
     .main {
         padding: 2rem;
@@ -79,7 +83,8 @@ st.markdown("""
         margin-bottom: 10px;
     }
 </style>
-""", unsafe_allow_html=True)
+"""
+st.markdown(CUSTOM_CSS, unsafe_allow_html=True)
 
 def get_api_key():
     """Get the API key from environment or session state."""
@@ -96,6 +101,14 @@ def get_api_key():
     # If not found, return None
     return None
 
+@st.cache_resource(show_spinner=False)
+def _get_orchestrator(agent_type, api_key_hash):
+    """
+    Build the orchestrator once per (agent type, API key) and reuse it across reruns.
+    The key is hashed for the cache key; the real key is read from the session state.
+    """
+    return CalculatorOrchestrator(agent_type=agent_type, api_key=st.session_state.api_key, verbose=False)
+
 def create_orchestrator(agent_type="stepwise", api_key=None):
     """Create an orchestrator instance."""
     if not api_key:
@@ -104,60 +117,36 @@ def create_orchestrator(agent_type="stepwise", api_key=None):
             st.error("No API key found. Please enter your OpenAI API key.")
             return None
     
+    st.session_state.api_key = api_key
+    api_key_hash = hashlib.sha256(api_key.encode()).hexdigest()
+    
     try:
-        return CalculatorOrchestrator(agent_type=agent_type, api_key=api_key)
+        return _get_orchestrator(agent_type, api_key_hash)
     except Exception as e:
         st.error(f"Error initializing calculator: {str(e)}")
         return None
 
-def calculate_with_steps(orchestrator, expression, agent_type):
-    """Calculate expression and capture steps using string IO capture."""
-    # Create a StringIO object to capture stdout
-    f = io.StringIO()
-    
-    # Use contextlib to redirect stdout to our StringIO object
-    with contextlib.redirect_stdout(f):
-        try:
-            # Calculate the expression
-            result = orchestrator.calculate(expression)
-        except Exception as e:
-            return None, [], str(e)
-    
-    # Get the captured output
-    output = f.getvalue()
-    
-    # Process the output to extract steps
+def calculate_with_steps(orchestrator, expression, use_cache=True):
+    """Calculate expression and collect the steps reported by the agent."""
     steps = []
-    inside_steps_section = False
-    full_output = output.split('\n')
-    
-    for line in full_output:
-        line = line.strip()
-        
-        # Check for markers
-        if line == "--- CALCULATION STEPS BEGIN ---":
-            inside_steps_section = True
-            continue
-        elif line == "--- CALCULATION STEPS END ---":
-            inside_steps_section = False
-            continue
-            
-        # Only process lines inside the steps section
-        if inside_steps_section and line:
-            # Handle step lines (both agent types)
-            if line.startswith("Step"):
-                if agent_type == "reducing" and "-->" in line:
-                    # For reducing agent, include both the calculation and the remaining expression
-                    # Format: "Step 1: 5 * 3 = 15 --> remaining expression: 10 + 15 - 8 / 2"
-                    steps.append(line)
-                else:
-                    # For stepwise agent, take the whole step
-                    steps.append(line)
-            elif line.startswith("Final result:"):
-                # This ensures we capture the final result line too
-                steps.append(line)
+    try:
+        result = orchestrator.calculate(expression, step_callback=steps.append, use_cache=use_cache)
+    except Exception as e:
+        return None, [], str(e)
     
-    return result, steps, output
+    return result, steps, ""
+
+@st.cache_data(ttl=24 * 60 * 60, max_entries=256, show_spinner=False)
+def cached_calculate_with_steps(_orchestrator, _expression, agent_type, normalized_expression):
+    """
+    Cached variant of calculate_with_steps, shared across reruns and sessions.
+    Keyed on the agent type and the whitespace-free expression; the orchestrator and the
+    raw expression are excluded from the key. Failures raise so they are never cached.
+    """
+    result, steps, error = calculate_with_steps(_orchestrator, _expression)
+    if result is None:
+        raise RuntimeError(error or "No result returned by the agent.")
+    return result, steps, error
 
 # Sidebar
 st.sidebar.title("Calculator Agent")
@@ -195,18 +184,29 @@ expression = st.text_input("Enter a mathematical expression",
 
 # Calculate button
 calculate_button = st.button("Calculate", type="primary")
+force_recompute = st.checkbox("Force recompute", value=False,
+                              help="Skip the result cache and run the agent again.")
 
 # Initialize or get the calculation history from session state
 if "calculation_history" not in st.session_state:
-    st.session_state.calculation_history = []
+    # Bounded so that reruns don't get slower as the session goes on: the oldest entries are dropped
+    st.session_state.calculation_history = deque(maxlen=MAX_HISTORY)
 
 # Calculate result
 if calculate_button and expression:
     orchestrator = create_orchestrator(agent_type, api_key)
     if orchestrator:
         with st.spinner(f"Calculating with {agent_type} agent..."):
-            # Calculate and get steps
-            result, steps, debug_output = calculate_with_steps(orchestrator, expression, agent_type)
+            # Calculate and get steps, reusing cached results for repeated expressions
+            if force_recompute:
+                result, steps, error = calculate_with_steps(orchestrator, expression, use_cache=False)
+            else:
+                try:
+                    normalized_expression = canonicalize(expression)
+                    result, steps, error = cached_calculate_with_steps(
+                        orchestrator, expression, agent_type, normalized_expression)
+                except Exception as e:
+                    result, steps, error = None, [], str(e)
             
             if result is not None:
                 # Add the calculation to history
@@ -214,14 +214,13 @@ if calculate_button and expression:
                     "expression": expression,
                     "result": result,
                     "agent_type": agent_type,
-                    "steps": steps,
-                    "debug_output": debug_output
+                    "steps": steps
                 })
                 
                 # Display the result
                 st.success(f"Calculation completed!")
             else:
-                st.error(f"Error during calculation: {debug_output}")
+                st.error(f"Error during calculation: {error}")
 
 # Display calculation history
 if st.session_state.calculation_history:
@@ -238,28 +237,14 @@ if st.session_state.calculation_history:
     else:
         # Use distinctive, colored boxes for each step
         for step in latest['steps']:
-            if step.startswith("Final result:"):
-                continue  # Skip final result
-                
-            if step.startswith("Step"):
-                if "-->" in step and latest['agent_type'] == 'reducing':
-                    # Format: "Step 1: 5 * 3 = 15 --> remaining expression: 10 + 15 - 8 / 2"
-                    parts = step.split("-->")
-                    step_number = parts[0].split(":")[0].strip()  # "Step 1"
-                    calculation = ":".join(parts[0].split(":")[1:]).strip()  # "5 * 3 = 15"
-                    remaining = parts[1].strip()  # "remaining expression: 10 + 15 - 8 / 2"
-                    
-                    # Display with colored background
-                    st.info(f"**{step_number}:** {calculation}\n\n**{remaining}**")
-                else:
-                    # Regular step (stepwise agent)
-                    step_number = step.split(":")[0].strip()  # "Step 1"
-                    calculation = ":".join(step.split(":")[1:]).strip()  # "5 * 3 = 15"
-                    
-                    # Display with colored background
-                    st.info(f"**{step_number}:** {calculation}")
+            calculation = ", ".join(step.call_steps)  # "5 * 3 = 15"
+            
+            if step.remaining_expression and latest['agent_type'] == 'reducing':
+                # Display with colored background, including the reduced expression
+                st.info(f"**Step {step.number}:** {calculation}\n\n**remaining expression: {step.remaining_expression}**")
             else:
-                st.info(step)
+                # Regular step (stepwise agent)
+                st.info(f"**Step {step.number}:** {calculation}")
     
     # Display the result
     st.markdown(f"<div class='final-result'>Result: {latest['result']}</div>", unsafe_allow_html=True)
@@ -267,8 +252,8 @@ if st.session_state.calculation_history:
     # Previous calculations
     if len(st.session_state.calculation_history) > 1:
         st.subheader("Previous Calculations")
-        for i, calc in enumerate(reversed(st.session_state.calculation_history[:-1])):
-            with st.expander(f"{calc['expression']} = {calc['result']} ({calc['agent_type']})"):
+        for i, calc in enumerate(islice(reversed(st.session_state.calculation_history), 1, None)):
+            with st.expander(f"{calc['expression']} = {calc['result']} ({calc['agent_type']})", expanded=False):
                 # Just display a simple summary instead of detailed steps
                 st.markdown(f"""<div class="prev-calc-summary">
                     <div><strong>Expression:</strong> <code>{calc['expression']}</code></div>
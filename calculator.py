@@ -5,8 +5,10 @@ This script provides a simple way to run the calculator agent from the command l
 """
 
 import sys
+import logging
 import os
 import argparse
+from typing import Optional
 from dotenv import load_dotenv
 
 # Add the project directory to the Python path
@@ -15,7 +17,8 @@ sys.path.insert(0, project_dir)
 
 # Import the necessary modules
 from src.orchestrator import CalculatorOrchestrator
-
+from src.utils.env import get_api_key
+from src.utils.stdout import buffer_stdout
 
 def setup_parser() -> argparse.ArgumentParser:
     """Set up command line argument parser."""
@@ -57,17 +60,9 @@ def setup_parser() -> argparse.ArgumentParser:
     return parser
 
 
-def get_api_key_from_env() -> str:
+def get_api_key_from_env() -> Optional[str]:
     """Try to get API key from environment variables or .env file."""
-    # Load environment variables from .env file
-    load_dotenv()
-    
-    # Try standard environment variables
-    for var_name in ['OPENAI_API_KEY', 'OPEN_AI_TOKEN_2', 'OPENAI_KEY', 'OPEN_AI_KEY']:
-        if var_name in os.environ and os.environ.get(var_name):
-            return os.environ.get(var_name)
-    
-    return None
+    return get_api_key()
 
 
 def interactive_mode(orchestrator: CalculatorOrchestrator) -> None:
@@ -115,6 +110,13 @@ def main() -> None:
     parser = setup_parser()
     args = parser.parse_args()
     
+    # Batch the per-step output into fewer writes
+    buffer_stdout(interactive=args.interactive)
+    
+    # The calculation steps are logged at INFO level by the src.* loggers, to the (buffered) stdout
+    logging.basicConfig(level=logging.WARNING, format="%(message)s", stream=sys.stdout)
+    logging.getLogger("src").setLevel(logging.INFO)
+    
     # Get API key from command line args or environment
     api_key = args.api_key or get_api_key_from_env()
     if not api_key:
@@ -140,6 +142,7 @@ def main() -> None:
         try:
             result = orchestrator.calculate(args.expression)
             print(f"Result: {result}")
+            sys.stdout.flush()
         except Exception as e:
             print(f"Error: {e}")
             sys.exit(1)
@@ -5,21 +5,20 @@ Direct test script that uses API key from .env file.
 
 import os
 import sys
-from dotenv import load_dotenv
+import logging
 
 # Add project directory to Python path
 sys.path.insert(0, os.path.abspath('.'))
 
 from src.orchestrator import CalculatorOrchestrator
+from src.utils import env
+from src.utils.stdout import buffer_stdout
 
-def get_api_key():
-    """Get the API key from environment variables."""
-    # Load environment variables from .env file
-    load_dotenv()
-    
-    for var_name in ["OPENAI_API_KEY", "OPEN_AI_TOKEN_2", "OPENAI_KEY", "OPEN_AI_KEY"]:
-        if var_name in os.environ:
-            return os.environ.get(var_name)
+def get_api_key() -> str:
+    """Get the API key from environment variables or the .env file."""
+    api_key = env.get_api_key()
+    if api_key:
+        return api_key
     
     print("ERROR: No API key found in environment variables.")
     print("Please set OPENAI_API_KEY in your .env file.")
@@ -53,7 +52,11 @@ def test_calculator():
     print(f"Result: {result}")
     
     print("Test completed successfully!")
+    sys.stdout.flush()
 
 
 if __name__ == "__main__":
+    buffer_stdout()
+    logging.basicConfig(level=logging.WARNING, format="%(message)s", stream=sys.stdout)
+    logging.getLogger("src").setLevel(logging.INFO)
     test_calculator() 
\ No newline at end of file
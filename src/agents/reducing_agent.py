@@ -1,13 +1,61 @@
-import json
-from typing import List, Tuple, Any, Optional, Union
+import io
+import re
+import logging
+from typing import List, Tuple, Any, Optional, Union, Callable, Generator
 
+from src.agents.step_record import StepRecord
 from src.agents.tool_call_result import ToolCallResult
-from src.agents.utility import validate_expression, reduce_expression
+from src.agents.utility import validate_expression, parse_tool_call_arguments, reduce_expression, \
+    evaluate_locally, drive_calculation, adrive_calculation, STEPS_BEGIN_MARKER, STEPS_END_MARKER
 
-from src.tools.calculator import calculate
+from src.tools.calculator import calculate, OPERATIONS
 from src.llm.llm_base import LLMClientBase
 from src.llm.chatgpt import MessageHistory
 
+logger = logging.getLogger(__name__)
+
+_SPACE_TABLE = str.maketrans('', '', ' \t')
+_INNER_PARENS_RE = re.compile(r'\(([^()]+)\)')   # Innermost parenthesized group
+
+
+def _canon(expression: str) -> str:
+    """Strip whitespace so that expressions differing only in spacing compare equal."""
+    return expression.translate(_SPACE_TABLE)
+
+
+def _reduce_parens(expression: str) -> Tuple[str, List[str]]:
+    """
+    Evaluate parenthesized groups locally, innermost first, and substitute their results.
+    Groups that cannot be evaluated locally are left in place for the LLM.
+
+    :param expression: The expression to simplify
+    :return: The simplified expression and a description of each group that was evaluated
+    """
+    call_steps: List[str] = []
+
+    def evaluate_group(match: re.Match) -> str:
+        # Leave implicit multiplication such as "2(3 + 1)" to the LLM: dropping the parentheses would merge numbers
+        before = match.string[:match.start()].rstrip()[-1:]
+        after = match.string[match.end():].lstrip()[:1]
+        if (before and before in '0123456789.)') or (after and after in '0123456789.('):
+            return match.group(0)
+
+        evaluation = evaluate_locally(match.group(1))
+        if evaluation is None:
+            return match.group(0)
+
+        value, operations = evaluation
+        if operations:
+            call_steps.append(f"({match.group(1).strip()}) = {value}")
+        # A negative result keeps its parentheses: "(1 - 3) ** 2" must not become "-2 ** 2"
+        return str(value) if value >= 0 else f"({value})"
+
+    while True:
+        reduced = _INNER_PARENS_RE.sub(evaluate_group, expression)
+        if reduced == expression:
+            return expression, call_steps
+        expression = reduced
+
 
 class ReducingCalculatorAgent:
     """
@@ -24,33 +72,93 @@ class ReducingCalculatorAgent:
         self.system_prompt: str = config['system_prompt']
         self.prompt: str = config['prompt']
         self.max_llm_calls: int = config['max_llm_calls']
+        self.verbose: bool = config.get('verbose', True)
+        self.trust_safe_eval: bool = config.get('trust_safe_eval', True)
 
-    def run(self, expression: str) -> Optional[float]:
+        # The system message is identical for every call: build it once and copy it per prompt
+        self._base_history = MessageHistory()
+        self._base_history.add_system_message(self.system_prompt)
+        self._prompt_parts: List[str] = self.prompt.split('{EXPRESSION}')
+
+    def run(self, expression: str,
+            step_callback: Optional[Callable[[StepRecord], None]] = None) -> Optional[float]:
         """
        Run the reducing calculation process for the given expression.
 
        :param expression: The mathematical expression to evaluate
+       :param step_callback: Optional callable that receives a StepRecord after each step
        :return: The final result of the calculation, or None if not successful
        """
+        # The step trace is accumulated in a single buffer and written out once at the end
+        log = io.StringIO()
+        try:
+            return drive_calculation(self._calculation(expression, log, step_callback), self.llm_client)
+        finally:
+            if self.verbose:
+                logger.info(log.getvalue().rstrip('\n'))
+
+    async def arun(self, expression: str,
+                   step_callback: Optional[Callable[[StepRecord], None]] = None) -> Optional[float]:
+        """
+       Asynchronous version of run(): the LLM calls are awaited, so several expressions can be calculated concurrently.
 
-        print(f"Input expression: {expression}")
-        print("--- CALCULATION STEPS BEGIN ---")
+       :param expression: The mathematical expression to evaluate
+       :param step_callback: Optional callable that receives a StepRecord after each step
+       :return: The final result of the calculation, or None if not successful
+       """
+        log = io.StringIO()
+        try:
+            return await adrive_calculation(self._calculation(expression, log, step_callback), self.llm_client)
+        finally:
+            if self.verbose:
+                logger.info(log.getvalue().rstrip('\n'))
+
+    def _calculation(self, expression: str, log: io.StringIO,
+                     step_callback: Optional[Callable[[StepRecord], None]] = None
+                     ) -> Generator[MessageHistory, Any, Optional[float]]:
+        """
+        The calculation loop shared by run() and arun(), writing the step trace to the given buffer.
+        Yields each prompt and receives the LLM response to it, so that the caller decides how the LLM is called.
+        """
+        log.write(f"Input expression: {expression}\n")
+        log.write(f"{STEPS_BEGIN_MARKER}\n")
 
         # Invalid expressions will raise an exception
         validate_expression(expression, self.max_expression_length)
-        
-        # Pre-process expressions with parentheses to make it easier for the LLM
-        has_parentheses = '(' in expression
-        if has_parentheses:
-            print("Expression contains parentheses - pre-processing to simplify")
 
-        steps: List[str] = []
+        # Plain arithmetic can be evaluated locally, without spending any LLM calls
+        if self.trust_safe_eval:
+            local_result = self._try_safe_eval(expression, log, step_callback)
+            if local_result is not None:
+                return local_result
+        
         final_result: Optional[float] = None
         i = 1
+
+        # Pre-process expressions with parentheses to make it easier for the LLM. Like the local evaluation above,
+        # this is skipped when trust_safe_eval is off, so that the LLM sees the parentheses
+        has_parentheses = '(' in expression
+        if self.trust_safe_eval and has_parentheses:
+            log.write("Expression contains parentheses - pre-processing to simplify\n")
+            expression, call_steps = _reduce_parens(expression)
+
+            if call_steps:
+                log.write(f"Step {i}: {'    ,   '.join(call_steps)} --> remaining expression: {expression}\n")
+                if step_callback is not None:
+                    step_callback(StepRecord(i, call_steps, expression))
+                i += 1
+
+            # Nothing is left for the LLM if the groups reduced to a single number
+            evaluation = evaluate_locally(expression)
+            if evaluation is not None and not evaluation[1]:
+                final_result = evaluation[0]
+                log.write(f"Final result: {final_result}\n")
+                log.write(f"{STEPS_END_MARKER}\n")
+                return final_result
         
         # Keep track of previous expressions to detect loops
         previous_expressions = set()
-        previous_expressions.add(expression)
+        previous_expressions.add(_canon(expression))
 
         while True:
             # print(f'\n ================ iteration {i} ================ \n')
@@ -60,156 +168,138 @@ class ReducingCalculatorAgent:
             # print('\n----- prompt_msg -----\n')
             # print(prompt_msg)
 
-            response = self.llm_client.run_prompt(prompt_msg)
+            response = yield prompt_msg
 
-            result = self._process_tool_calls(response.tool_calls, expression)
+            result = self._process_tool_calls(response.tool_calls, expression, log)
 
             expression = result.remaining_expression
 
-            print(f"Step {i}: {'    ,   '.join(result.call_steps)} --> remaining expression: {expression}")
+            log.write(f"Step {i}: {'    ,   '.join(result.call_steps)} --> remaining expression: {expression}\n")
+            if step_callback is not None:
+                step_callback(StepRecord(i, result.call_steps, expression))
             
             # Check if we're stuck in a loop where the expression isn't changing
-            if expression in previous_expressions:
-                print(f"Warning: Expression '{expression}' has been seen before - possible loop detected")
+            canonical_expression = _canon(expression)
+            if canonical_expression in previous_expressions:
+                log.write(f"Warning: Expression '{expression}' has been seen before - possible loop detected\n")
                 
-                # If this is a truly simple expression, try to evaluate it directly
-                if expression.count('+') + expression.count('-') + expression.count('*') + expression.count('/') == 1:
-                    for op in ['+', '-', '*', '/']:
-                        if op in expression:
-                            try:
-                                parts = expression.split(op)
-                                if len(parts) == 2:
-                                    a = float(parts[0].strip())
-                                    b = float(parts[1].strip())
-                                    
-                                    if op == '+':
-                                        final_result = a + b
-                                    elif op == '-':
-                                        final_result = a - b
-                                    elif op == '*':
-                                        final_result = a * b
-                                    elif op == '/' and b != 0:
-                                        final_result = a / b
-                                        
-                                    print(f"Fallback calculation: {a} {op} {b} = {final_result}")
-                                    print(f"Final result: {final_result}")
-                                    print("--- CALCULATION STEPS END ---")
-                                    return final_result
-                            except:
-                                pass
+                # If this is a truly simple expression (a single operator), try to evaluate it directly
+                operators = [c for c in canonical_expression if c in OPERATIONS]
+                if len(operators) == 1:
+                    op = operators[0]
+                    a_str, _, b_str = canonical_expression.partition(op)
+                    try:
+                        a, b = float(a_str), float(b_str)
+                    except ValueError:
+                        pass
+                    else:
+                        if op != '/' or b != 0:
+                            final_result = OPERATIONS[op](a, b)
+
+                            log.write(f"Fallback calculation: {a} {op} {b} = {final_result}\n")
+                            log.write(f"Final result: {final_result}\n")
+                            log.write(f"{STEPS_END_MARKER}\n")
+                            return final_result
             
             # Add to previous expressions
-            previous_expressions.add(expression)
+            previous_expressions.add(canonical_expression)
 
             if result.is_final_step:
                 final_result = result.results[-1][0]   # Last result --> first element in the tuple
-                print(f"Final result: {final_result}")
+                log.write(f"Final result: {final_result}\n")
                 break
 
-            steps.extend(result.call_steps)
-
             if i >= self.max_llm_calls:
-                # Try one last evaluation if the expression looks simple enough
-                try:
-                    # This is a risky call to eval(), but the expression should be validated already
-                    import ast
-                    # Use ast.literal_eval which is safer than eval
-                    final_result = eval(expression)
-                    print(f"Reached max calls but resolved with direct evaluation: {final_result}")
-                    print(f"Final result: {final_result}")
-                    print("--- CALCULATION STEPS END ---")
-                    return final_result
-                except:
+                # Try one last evaluation if the remaining expression is plain arithmetic
+                evaluation = evaluate_locally(expression)
+                if evaluation is None:
                     raise RuntimeError(f'Max LLM calls reached before final result. Max calls: {self.max_llm_calls}')
 
+                final_result = evaluation[0]
+                log.write(f"Reached max calls but resolved with direct evaluation: {final_result}\n")
+                log.write(f"Final result: {final_result}\n")
+                log.write(f"{STEPS_END_MARKER}\n")
+                return final_result
+
             i += 1
 
-        print("--- CALCULATION STEPS END ---")
+        log.write(f"{STEPS_END_MARKER}\n")
         return final_result
 
-    def _process_tool_calls(self, tool_calls: List[Any], expression: str) -> ToolCallResult:
+    def _try_safe_eval(self, expression: str, log: io.StringIO,
+                       step_callback: Optional[Callable[[StepRecord], None]] = None) -> Optional[float]:
+        """
+        Evaluate the expression locally and replay each operation as a step, as if the LLM produced it.
+
+        :param expression: The validated expression to evaluate
+        :param log: Buffer collecting the step trace
+        :param step_callback: Optional callable that receives a StepRecord after each step
+        :return: The final result, or None if the expression has to be evaluated by the LLM
+        """
+        evaluation = evaluate_locally(expression)
+        if evaluation is None:
+            return None
+
+        final_result, operations = evaluation
+
+        for i, (a, op, b, result) in enumerate(operations, start=1):
+            expression = reduce_expression(expression, a, b, op, result)
+            call_steps = [f"{a} {op} {b} = {result}"]
+
+            log.write(f"Step {i}: {call_steps[0]} --> remaining expression: {expression}\n")
+            if step_callback is not None:
+                step_callback(StepRecord(i, call_steps, expression))
+
+        log.write(f"Final result: {final_result}\n")
+        log.write(f"{STEPS_END_MARKER}\n")
+        return final_result
+
+    def _process_tool_calls(self, tool_calls: List[Any], expression: str, log: io.StringIO) -> ToolCallResult:
         """
         Process the tool calls returned by the LLM and perform the calculations.
 
         :param tool_calls: A list of tool calls from the LLM response
         :param expression: The current expression being evaluated
+        :param log: Buffer collecting the step trace
         :return: A ToolCallResult object containing the results, step information, and reduced expression
         """
         if not tool_calls:
             raise RuntimeError("Error: Expected a tool call but received none.")
 
-        function_call_result_message = []
-
         results: List[Tuple[float, str]] = []
         is_final_step = False
         call_steps: List[str] = []
 
+        # The per-tool-call diagnostics are only formatted when debug logging is enabled
+        debug = logger.isEnabledFor(logging.DEBUG)
+
+        # Bind the functions used in the loop to locals once, rather than looking them up per tool call
+        _write = log.write
+        _parse = parse_tool_call_arguments
+        _calc = calculate
+        _reduce = reduce_expression
+        _append = call_steps.append
+        _rappend = results.append
+
         # Handle the potential case of multiple tool calls returned by the LLM
         for tool_call in tool_calls:
             function_call = tool_call.function
+            name, raw_args, tool_call_id = function_call.name, function_call.arguments, tool_call.id
 
-            try:
-                print(f"Processing tool call: {function_call.name}, arguments: {function_call.arguments}")
-                func_args = json.loads(function_call.arguments)
-                
-                # Check for typo in 'op' key name ('op:' instead of 'op')
-                if 'op:' in func_args and 'op' not in func_args:
-                    print("Found 'op:' instead of 'op' in arguments, fixing...")
-                    func_args['op'] = func_args['op:']
-                    
-                a = func_args['a']
-                b = func_args['b']
-                op = func_args['op']
-                is_final_step = func_args['is_final_step']
-                
-                print(f"Parsed arguments - a: {a}, b: {b}, op: '{op}' (type: {type(op)}), is_final_step: {is_final_step}")
-                
-                # Ensure op is a valid operation string
-                if not isinstance(op, str):
-                    raise ValueError(f"Operation must be a string, got {type(op).__name__}: {op}")
-                
-                # Ensure op is one of the allowed operations
-                if op not in ['+', '-', '*', '/']:
-                    raise ValueError(f"Invalid operation: '{op}'. Must be one of: +, -, *, /")
-                
-            except (KeyError, ValueError, json.JSONDecodeError) as e:
-                print(f"Error parsing arguments: {e}")
-                print(f"Raw arguments: {function_call.arguments}")
-                
-                # Try to fix common issues with tool call arguments
-                try:
-                    # Re-parse as JSON but with some preprocessing
-                    fixed_args = function_call.arguments.replace("op:", "op")
-                    func_args = json.loads(fixed_args)
-                    
-                    print(f"Attempting with fixed arguments: {fixed_args}")
-                    
-                    a = func_args['a']
-                    b = func_args['b']
-                    op = func_args['op']
-                    is_final_step = func_args['is_final_step']
-                    
-                    print(f"Fixed and parsed: a: {a}, b: {b}, op: '{op}', is_final_step: {is_final_step}")
-                except Exception as fix_error:
-                    # If the fix also fails, raise the original error
-                    raise RuntimeError(f"Invalid tool call arguments format: {function_call.arguments}. \n error: {e}")
-
-            result = calculate(a, b, op)
-
-            expression = reduce_expression(expression, a, b, op, result)
+            if debug:
+                _write(f"Processing tool call: {name}, arguments: {raw_args}\n")
+            a, b, op, is_final_step = _parse(raw_args)
+            if debug:
+                _write(f"Parsed arguments - a: {a}, b: {b}, op: '{op}', is_final_step: {is_final_step}\n")
 
-            # If expression not found before final step --> Error
+            result = _calc(a, b, op)
 
-            step = f"{a} {op} {b} = {result}"
-            call_steps.append(step)
+            expression = _reduce(expression, a, b, op, result)
 
-            results.append((result, tool_call.id))
+            # If expression not found before final step --> Error
 
-            function_call_result_message.append({
-                "role": "tool",
-                "content": json.dumps({"result": result}),
-                "tool_call_id": tool_call.id
-            })
+            _append(f"{a} {op} {b} = {result}")
+            _rappend((result, tool_call_id))
 
         return ToolCallResult(results, is_final_step, call_steps, expression)
 
@@ -217,10 +307,9 @@ class ReducingCalculatorAgent:
         """
         Prepare the prompt for the next iteration of the calculation process.
         """
-        prompt = self.prompt.replace('{EXPRESSION}', expression)
+        prompt = expression.join(self._prompt_parts)
 
-        prompt_msg = MessageHistory()
-        prompt_msg.add_system_message(self.system_prompt)
+        prompt_msg = self._base_history.copy()
         prompt_msg.add_user_message(prompt)
 
         return prompt_msg
@@ -0,0 +1,11 @@
+from dataclasses import dataclass
+from typing import List
+
+
+@dataclass
+class StepRecord:
+    __slots__ = ('number', 'call_steps', 'remaining_expression')   # One per step, kept in the orchestrator's response cache
+
+    number: int
+    call_steps: List[str]           # ["a op b = result", ...]
+    remaining_expression: str       # Reduced expression after this step ('' for the stepwise agent)
@@ -1,13 +1,27 @@
-import json
-from typing import List, Tuple, Any, Optional
+import math
+import string
+import logging
+from typing import List, Tuple, Any, Optional, Callable, Generator
 
+from src.agents.step_record import StepRecord
 from src.agents.tool_call_result import ToolCallResult
-from src.agents.utility import validate_expression
+from src.agents.utility import validate_expression, parse_tool_call_arguments, evaluate_locally, \
+    drive_calculation, adrive_calculation, STEPS_BEGIN_MARKER, STEPS_END_MARKER
 
 from src.tools.calculator import calculate
 from src.llm.llm_base import LLMClientBase
 from src.llm.chatgpt import MessageHistory
 
+logger = logging.getLogger(__name__)
+
+
+def _prompt_template(prompt: str, *placeholders: str) -> string.Template:
+    """Turn a config prompt with {PLACEHOLDER} fields into a string.Template, escaping any literal '$'."""
+    prompt = prompt.replace('$', '$$')
+    for placeholder in placeholders:
+        prompt = prompt.replace(f'{{{placeholder}}}', f'${{{placeholder}}}')
+    return string.Template(prompt)
+
 
 class StepwiseCalculatorAgent:
     """
@@ -26,30 +40,66 @@ class StepwiseCalculatorAgent:
         self.subsequent_prompt: str = config['subsequent_prompt']
         self.initial_prompt: str = config['initial_prompt']
 
+        # The prompt templates are prepared once, then filled in with a single substitute() per prompt
+        self._initial_template = _prompt_template(self.initial_prompt, 'EXPRESSION')
+        self._subsequent_template = _prompt_template(self.subsequent_prompt, 'EXPRESSION', 'STEPS_SO_FAR')
+
         self.max_llm_calls: int = config['max_llm_calls']
         self.return_tool_call_msgs: bool = config['return_tool_call_msgs']
         self.append_messages: bool = config['append_messages']
+        self.verbose: bool = config.get('verbose', True)
+        self.trust_safe_eval: bool = config.get('trust_safe_eval', True)
+
+        # The system message is identical for every prompt: build it once and copy it per calculation
+        self._base_history = MessageHistory()
+        self._base_history.add_system_message(self.system_prompt)
 
-    def run(self, expression: str) -> Optional[float]:
+    def run(self, expression: str,
+            step_callback: Optional[Callable[[StepRecord], None]] = None) -> Optional[float]:
         """
         Run the stepwise calculation process for the given expression.
 
         :param expression: The mathematical expression to evaluate
+        :param step_callback: Optional callable that receives a StepRecord after each step
+        :return: The final result of the calculation, or None if not successful
+        """
+        return drive_calculation(self._calculation(expression, step_callback), self.llm_client)
+
+    async def arun(self, expression: str,
+                   step_callback: Optional[Callable[[StepRecord], None]] = None) -> Optional[float]:
+        """
+        Asynchronous version of run(): the LLM calls are awaited, so several expressions can be calculated concurrently.
+
+        :param expression: The mathematical expression to evaluate
+        :param step_callback: Optional callable that receives a StepRecord after each step
         :return: The final result of the calculation, or None if not successful
         """
-        print(f"Input expression: {expression}")
-        print("--- CALCULATION STEPS BEGIN ---")
+        return await adrive_calculation(self._calculation(expression, step_callback), self.llm_client)
+
+    def _calculation(self, expression: str, step_callback: Optional[Callable[[StepRecord], None]] = None
+                     ) -> Generator[MessageHistory, Any, Optional[float]]:
+        """
+        The calculation loop shared by run() and arun(). Yields each prompt and receives the LLM response to it,
+        so that the caller decides how the LLM is called.
+        """
+        if self.verbose:
+            logger.info(f"Input expression: {expression}")
+            logger.info(STEPS_BEGIN_MARKER)
 
         # Invalid expressions will raise an exception
         validate_expression(expression, self.max_expression_length)
 
-        initial_prompt = self.initial_prompt.replace('{EXPRESSION}', expression)
+        # Plain arithmetic can be evaluated locally: either instead of the LLM, or to verify its final result
+        evaluation = evaluate_locally(expression)
+        if evaluation is not None and self.trust_safe_eval:
+            return self._replay_local_evaluation(evaluation, step_callback)
+
+        initial_prompt = self._initial_template.substitute(EXPRESSION=expression)
 
-        prompt_msg = MessageHistory()
-        prompt_msg.add_system_message(self.system_prompt)
+        prompt_msg = self._base_history.copy()
         prompt_msg.add_user_message(initial_prompt)
 
-        steps: List[str] = []
+        steps_so_far = ''   # The calculated steps, one per line, extended as the calculation proceeds
         final_result: Optional[float] = None
         i = 1
 
@@ -59,27 +109,62 @@ class StepwiseCalculatorAgent:
             # print('\n----- prompt_msg -----\n')
             # print(prompt_msg)
 
-            response = self.llm_client.run_prompt(prompt_msg)
+            response = yield prompt_msg
 
             result = self._process_tool_calls(response.tool_calls)
 
-            print(f"Step {i}: {'    ,   '.join(result.call_steps)}")
+            if self.verbose:
+                logger.info(f"Step {i}: {'    ,   '.join(result.call_steps)}")
+            if step_callback is not None:
+                step_callback(StepRecord(i, result.call_steps, ''))
 
             if result.is_final_step:
                 final_result = result.results[-1][0]   # Last result --> first element in the tuple
-                print(f"Final result: {final_result}")
+                if self.verbose:
+                    logger.info(f"Final result: {final_result}")
+                if evaluation is None:
+                    logger.warning(f"Final result {final_result} of '{expression}' could not be verified locally")
+                elif not math.isclose(final_result, evaluation[0], rel_tol=1e-9, abs_tol=1e-9):
+                    # Fail rather than return (and let the orchestrator cache) a result known to be wrong
+                    raise RuntimeError(f"Final result {final_result} of '{expression}' differs from the local "
+                                       f"evaluation {evaluation[0]}")
                 break
 
-            steps.extend(result.call_steps)
+            new_steps = '\n'.join(result.call_steps)
+            steps_so_far = f"{steps_so_far}\n{new_steps}" if steps_so_far else new_steps
 
-            prompt_msg = self._prepare_next_prompt(prompt_msg, expression, steps, result.results, response)
+            prompt_msg = self._prepare_next_prompt(prompt_msg, expression, steps_so_far, result.results, response)
 
             if i >= self.max_llm_calls:
                 raise RuntimeError(f'Max LLM calls reached before final result. Max calls: {self.max_llm_calls}')
 
             i += 1
 
-        print("--- CALCULATION STEPS END ---")
+        if self.verbose:
+            logger.info(STEPS_END_MARKER)
+        return final_result
+
+    def _replay_local_evaluation(self, evaluation: Tuple[float, Tuple[Tuple[float, str, float, float], ...]],
+                                 step_callback: Optional[Callable[[StepRecord], None]] = None) -> float:
+        """
+        Report the operations of a local evaluation as steps, as if the LLM produced them, and return its result.
+
+        :param evaluation: The (result, operations) tuple returned by evaluate_locally()
+        :param step_callback: Optional callable that receives a StepRecord after each step
+        :return: The final result
+        """
+        final_result, operations = evaluation
+
+        for i, (a, op, b, result) in enumerate(operations, start=1):
+            call_steps = [f"{a} {op} {b} = {result}"]
+            if self.verbose:
+                logger.info(f"Step {i}: {call_steps[0]}")
+            if step_callback is not None:
+                step_callback(StepRecord(i, call_steps, ''))
+
+        if self.verbose:
+            logger.info(f"Final result: {final_result}")
+            logger.info(STEPS_END_MARKER)
         return final_result
 
     def _process_tool_calls(self, tool_calls: List[Any]) -> ToolCallResult:
@@ -92,77 +177,33 @@ class StepwiseCalculatorAgent:
         if not tool_calls:
             raise RuntimeError("Error: Expected a tool call but received none.")
 
-        results: List[Tuple[float, str]] = []
-        is_final_step = False
-        call_steps: List[str] = []
-
-        # Handle the potential case of multiple tool calls returned by the LLM
+        # The LLM may return several independent tool calls: parse and validate all of them first,
+        # so that a malformed call fails the step before any calculation is done
+        parsed: List[Tuple[Any, Any, str, bool]] = []
         for tool_call in tool_calls:
             function_call = tool_call.function
 
-            try:
-                print(f"Processing tool call: {function_call.name}, arguments: {function_call.arguments}")
-                func_args = json.loads(function_call.arguments)
-                
-                # Check for typo in 'op' key name ('op:' instead of 'op')
-                if 'op:' in func_args and 'op' not in func_args:
-                    print("Found 'op:' instead of 'op' in arguments, fixing...")
-                    func_args['op'] = func_args['op:']
-                    
-                a = func_args['a']
-                b = func_args['b']
-                op = func_args['op']
-                is_final_step = func_args['is_final_step']
-                
-                print(f"Parsed arguments - a: {a}, b: {b}, op: '{op}' (type: {type(op)}), is_final_step: {is_final_step}")
-                
-                # Ensure op is a valid operation string
-                if not isinstance(op, str):
-                    raise ValueError(f"Operation must be a string, got {type(op).__name__}: {op}")
-                
-                # Ensure op is one of the allowed operations
-                if op not in ['+', '-', '*', '/']:
-                    raise ValueError(f"Invalid operation: '{op}'. Must be one of: +, -, *, /")
-                
-            except (KeyError, ValueError, json.JSONDecodeError) as e:
-                print(f"Error parsing arguments: {e}")
-                print(f"Raw arguments: {function_call.arguments}")
-                
-                # Try to fix common issues with tool call arguments
-                try:
-                    # Re-parse as JSON but with some preprocessing
-                    fixed_args = function_call.arguments.replace("op:", "op")
-                    func_args = json.loads(fixed_args)
-                    
-                    print(f"Attempting with fixed arguments: {fixed_args}")
-                    
-                    a = func_args['a']
-                    b = func_args['b']
-                    op = func_args['op']
-                    is_final_step = func_args['is_final_step']
-                    
-                    print(f"Fixed and parsed: a: {a}, b: {b}, op: '{op}', is_final_step: {is_final_step}")
-                except Exception as fix_error:
-                    # If the fix also fails, raise the original error
-                    raise RuntimeError(f"Invalid tool call arguments format: {function_call.arguments}. \n error: {e}")
-                    
-            result = calculate(a, b, op)
-
-            step = f"{a} {op} {b} = {result}"
-            call_steps.append(step)
-
-            results.append((result, tool_call.id))
+            logger.debug("Processing tool call: %s, arguments: %s", function_call.name, function_call.arguments)
+            a, b, op, is_final_step = parse_tool_call_arguments(function_call.arguments)
+            logger.debug("Parsed arguments - a: %s, b: %s, op: '%s', is_final_step: %s", a, b, op, is_final_step)
+
+            parsed.append((a, b, op, is_final_step))
+
+        # Every call has been validated: now perform the calculations, in the order the LLM returned them
+        values = [calculate(a, b, op) for a, b, op, _ in parsed]
+
+        results: List[Tuple[float, str]] = [(value, tool_call.id) for value, tool_call in zip(values, tool_calls)]
+        call_steps: List[str] = [f"{a} {op} {b} = {value}" for (a, b, op, _), value in zip(parsed, values)]
+        is_final_step = parsed[-1][3]   # As before, the last tool call decides whether this is the final step
 
         return ToolCallResult(results, is_final_step, call_steps, '')
 
-    def _prepare_next_prompt(self, prompt_msg: MessageHistory, expression: str, steps: List[str],
+    def _prepare_next_prompt(self, prompt_msg: MessageHistory, expression: str, steps_so_far: str,
                              results: List[Tuple[float, str]], response: Any) -> MessageHistory:
         """
         Prepare the prompt for the next iteration of the calculation process. Several variants are possible.
         """
-        steps_so_far = '\n'.join(steps)
-        next_prompt = self.subsequent_prompt.replace('{EXPRESSION}', expression)
-        next_prompt = next_prompt.replace('{STEPS_SO_FAR}', steps_so_far)
+        next_prompt = self._subsequent_template.substitute(EXPRESSION=expression, STEPS_SO_FAR=steps_so_far)
 
         # print(next_prompt)
 
@@ -176,10 +217,9 @@ class StepwiseCalculatorAgent:
 
             prompt_msg.add_user_message(next_prompt)
 
-        # Fresh message history for the next iteration
+        # Fresh message history for the next iteration, starting with the same system message
         else:
-            prompt_msg = MessageHistory()
-            prompt_msg.add_system_message(self.system_prompt)
+            prompt_msg = self._base_history.copy()
             prompt_msg.add_user_message(next_prompt)
 
         return prompt_msg
@@ -4,6 +4,8 @@ from typing import List, Tuple
 
 @dataclass
 class ToolCallResult:
+    __slots__ = ('results', 'is_final_step', 'call_steps', 'remaining_expression')
+
     results: List[Tuple[float, str]]    # [(result, tool_call_id)]
     is_final_step: bool
     call_steps: List[str]
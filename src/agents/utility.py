@@ -1,24 +1,97 @@
 import re
 import ast
-from typing import Union, Optional
+from functools import lru_cache
+from typing import Union, Optional, List, Tuple, Any, Generator
+
+try:
+    import orjson   # Optional: faster parsing of tool call arguments
+    _json_loads = orjson.loads
+except ImportError:
+    import json
+    _json_loads = json.loads
+
+from src.tools.calculator import calculate
+from src.llm.llm_base import LLMClientBase
 
 Number = Union[int, float]
+Operation = Tuple[Number, str, Number, Number]   # (a, op, b, result)
+
+_BINARY_OPS = {ast.Add: '+', ast.Sub: '-', ast.Mult: '*', ast.Div: '/'}
+_AST_OPS = {op: node_type for node_type, op in _BINARY_OPS.items()}
+
+_WHITESPACE_RE = re.compile(r'\s+')
+
+# Only digits, spaces, and basic arithmetic operators are allowed
+_ALLOWED_CHARS_RE = re.compile(r'^[\d\s\+\-\*\/\(\)\.]+$')
+
+_VALID_OPS = frozenset('+-*/')
+
+# Markers framing the step trace printed by the agents
+STEPS_BEGIN_MARKER = "--- CALCULATION STEPS BEGIN ---"
+STEPS_END_MARKER = "--- CALCULATION STEPS END ---"
 
 
 def validate_expression(expression: str, max_expression_length: int) -> bool:
     if len(expression) > max_expression_length:
         raise ValueError(f"Expression exceeds maximum length of {max_expression_length} characters")
 
-    pattern = r'^[\d\s\+\-\*\/\(\)\.]+$'  # Only digits, spaces, and basic arithmetic operators are allowed
-
-    if re.match(pattern, expression) is None:
+    if _ALLOWED_CHARS_RE.match(expression) is None:
         raise ValueError(f"Invalid characters in the expression: {expression}")
 
     return True
 
 
+def canonicalize(expression: str) -> str:
+    """
+    Return a normal form of the expression, used as a cache key so that equivalent spellings share a result.
+    Whitespace and redundant parentheses are normalized away, e.g. "(10)+(5*3)" becomes "10 + 5 * 3".
+    Operands are not reordered: the steps taken (and float rounding) depend on the order of the operations.
+
+    Args:
+        expression: The expression to normalize
+
+    Returns:
+        The normalized expression, or the expression without whitespace if it cannot be parsed
+    """
+    try:
+        return ast.unparse(ast.parse(expression.strip(), mode='eval'))
+    except (SyntaxError, ValueError, RecursionError):   # RecursionError: deeply nested expressions
+        return _WHITESPACE_RE.sub('', expression)
+
+
+def parse_tool_call_arguments(arguments: str) -> Tuple[Number, Number, str, bool]:
+    """
+    Parse the JSON arguments of a calculate() tool call.
+    LLMs occasionally emit the key "op:" instead of "op": it is accepted as well.
+
+    Args:
+        arguments: The raw JSON arguments string of the tool call
+
+    Returns:
+        The tuple (a, b, op, is_final_step)
+    """
+    try:
+        func_args = _json_loads(arguments)
+        a = func_args['a']
+        b = func_args['b']
+        op = func_args['op'] if 'op' in func_args else func_args['op:']
+        is_final_step = func_args['is_final_step']
+    except (KeyError, TypeError, ValueError) as e:   # json.JSONDecodeError is a ValueError, as is orjson's
+        raise RuntimeError(f"Invalid tool call arguments format: {arguments}. \n error: {e}")
+
+    # Ensure op is a valid operation string
+    if not isinstance(op, str):
+        raise ValueError(f"Operation must be a string, got {type(op).__name__}: {op}")
+
+    # Ensure op is one of the allowed operations
+    if op not in _VALID_OPS:
+        raise ValueError(f"Invalid operation: '{op}'. Must be one of: +, -, *, /")
+
+    return a, b, op, is_final_step
+
+
 def float_to_str(f: float) -> str:
-    return f'{f: g}'.strip()
+    return format(f, 'g')
 
 
 def create_number_pattern(num: Union[int, float]) -> str:
@@ -29,10 +102,68 @@ def create_number_pattern(num: Union[int, float]) -> str:
         return r'\b' + float_to_str(num).replace('.', r'\.?') + r'\b'
 
 
+@lru_cache(maxsize=1024, typed=True)   # typed: 2 and 2.0 produce different number patterns
+def _operation_patterns(a: Number, b: Number, op: str) -> Tuple[re.Pattern, re.Pattern, re.Pattern]:
+    """
+    Compile the patterns used by reduce_expression() to find the operation "a op b" in an expression.
+
+    Returns:
+        The patterns for the operation in parentheses, the operation itself, and a less precise fallback
+    """
+    operation = create_number_pattern(a) + r'\s*' + re.escape(op) + r'\s*' + create_number_pattern(b)
+    parentheses_pattern = re.compile(r'\(' + r'\s*' + operation + r'\s*' + r'\)')
+    fallback_pattern = re.compile(f"{float_to_str(a)}\\s*\\{op}\\s*{float_to_str(b)}")
+    return parentheses_pattern, re.compile(operation), fallback_pattern
+
+
+def _constant_value(node: ast.AST) -> Optional[Number]:
+    """Return the value of a number node, including signed numbers such as -2, or None for any other node."""
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        value = _constant_value(node.operand)
+        if value is None:
+            return None
+        return -value if isinstance(node.op, ast.USub) else value
+
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return node.value
+
+    return None
+
+
+class _OperationReplacer(ast.NodeTransformer):
+    """Replace the leftmost operation "a op b" on two numbers with a number node holding the result."""
+
+    def __init__(self, a: Number, b: Number, op: str, result: Number) -> None:
+        self.a = a
+        self.b = b
+        self.op_type = _AST_OPS[op]
+        # Integral results are written without a trailing ".0", as the regex reduction did
+        if isinstance(result, float) and result.is_integer() and abs(result) < 1e16:
+            result = int(result)
+        self.result = result
+        self.done = False
+
+    def visit_BinOp(self, node: ast.BinOp) -> ast.AST:
+        if self.done:
+            return node
+
+        # Children first, so that the leftmost match in the expression text is replaced
+        self.generic_visit(node)
+
+        if (not self.done and isinstance(node.op, self.op_type)
+                and _constant_value(node.left) == self.a and _constant_value(node.right) == self.b):
+            self.done = True
+            return ast.copy_location(ast.Constant(self.result), node)
+
+        return node
+
+
 def reduce_expression(expression: str, a: Number, b: Number, op: str, result: Number) -> str:
     """
     Reduce a mathematical expression by replacing a specific operation with its result.
-    Handle special case of operations inside parentheses.
+    The expression is parsed and the matching operation node is replaced, which also drops its parentheses.
+    If the expression cannot be parsed, or the operation is not one of its nodes (e.g. the LLM reordered
+    "2 * 3 * 4" as 3 * 4), the operation is looked up in the expression text instead.
     
     Args:
         expression: The full expression
@@ -44,42 +175,132 @@ def reduce_expression(expression: str, a: Number, b: Number, op: str, result: Nu
     Returns:
         The reduced expression with the operation replaced by its result
     """
-    # Convert numbers to strings as they might be used in the expression
-    a_str = float_to_str(a)
-    b_str = float_to_str(b)
+    try:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except SyntaxError:
+        tree = None
+
+    if tree is not None:
+        replacer = _OperationReplacer(a, b, op, result)
+        tree = replacer.visit(tree)
+        if replacer.done:
+            return ast.unparse(tree)
+
+    return _reduce_expression_text(expression, a, b, op, result)
+
+
+def _reduce_expression_text(expression: str, a: Number, b: Number, op: str, result: Number) -> str:
+    """
+    Regex-based version of reduce_expression(), replacing the first occurrence of "a op b" in the expression text.
+    Handle special case of operations inside parentheses.
+    """
     result_str = float_to_str(result)
+    parentheses_pattern, pattern, fallback_pattern = _operation_patterns(a, b, op)
     
     # Handle special case of operations in parentheses like "(10 + 5)"
     if "(" in expression and ")" in expression:
-        # Try to find the exact operation in parentheses
-        parentheses_pattern = r'\(' + r'\s*' + create_number_pattern(a) + r'\s*' + re.escape(op) + r'\s*' + create_number_pattern(b) + r'\s*' + r'\)'
-        if re.search(parentheses_pattern, expression):
-            # Replace the entire parenthetical expression
-            new_expression = re.sub(parentheses_pattern, result_str, expression, count=1)
+        # Try to find the exact operation in parentheses and replace the entire parenthetical expression
+        new_expression, count = parentheses_pattern.subn(result_str, expression, count=1)
+        if count:
             return new_expression
     
     # Standard case: pattern = number op number (with boundaries)
-    pattern = create_number_pattern(a) + r'\s*' + re.escape(op) + r'\s*' + create_number_pattern(b)
-    new_expression = re.sub(pattern, result_str, expression, count=1)
+    new_expression = pattern.sub(result_str, expression, count=1)
     
     # If the expression didn't change, try a fallback approach with string replacement
     if new_expression == expression:
         # This is a more direct approach but less precise
-        op_pattern = f"{a_str}\\s*\\{op}\\s*{b_str}"
-        new_expression = re.sub(op_pattern, result_str, expression, count=1)
+        new_expression = fallback_pattern.sub(result_str, expression, count=1)
     
     return new_expression
 
 
 def safe_eval(expression: str) -> Optional[Number]:
-    """Safely evaluate a mathematical expression."""
+    """
+    Safely evaluate a mathematical expression.
+    The expression is parsed with ast and only the whitelisted arithmetic of evaluate_locally() is evaluated.
+
+    Returns:
+        The result, or None if the expression cannot be evaluated safely.
+    """
+    evaluation = evaluate_locally(expression)
+    return None if evaluation is None else evaluation[0]
+
+
+def _evaluate_node(node: ast.AST, operations: List[Operation]) -> Number:
+    """Evaluate a whitelisted arithmetic node, recording each binary operation in evaluation order."""
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return node.value
+
+    if isinstance(node, ast.UnaryOp) and isinstance(node.op, (ast.UAdd, ast.USub)):
+        operand = _evaluate_node(node.operand, operations)
+        return -operand if isinstance(node.op, ast.USub) else operand
+
+    if isinstance(node, ast.BinOp) and type(node.op) in _BINARY_OPS:
+        a = _evaluate_node(node.left, operations)
+        b = _evaluate_node(node.right, operations)
+        op = _BINARY_OPS[type(node.op)]
+        result = calculate(a, b, op)
+        operations.append((a, op, b, result))
+        return result
+
+    raise ValueError(f"Unsupported element in expression: {ast.dump(node)}")
+
+
+@lru_cache(maxsize=256)
+def evaluate_locally(expression: str) -> Optional[Tuple[Number, Tuple[Operation, ...]]]:
+    """
+    Evaluate an arithmetic expression without an LLM.
+    Only numbers, unary +/- and the operations +, -, *, / (with parentheses) are accepted.
+
+    Args:
+        expression: The expression to evaluate
+
+    Returns:
+        A tuple (result, operations) where operations holds the (a, op, b, result) steps in
+        evaluation order, or None if the expression cannot be evaluated safely.
+    """
     try:
-        # Remove spaces and ensure the expression contains only allowed characters
-        clean_expr = expression.strip()
-        if not re.match(r'^[\d\s\+\-\*\/\(\)\.]+$', clean_expr):
-            return None
-            
-        # Use a safer evaluation mechanism
-        return eval(clean_expr)
-    except:
+        tree = ast.parse(expression.strip(), mode='eval')
+    except (SyntaxError, RecursionError, MemoryError):   # Too deeply nested for the parser
         return None
+
+    operations: List[Operation] = []
+    try:
+        result = _evaluate_node(tree.body, operations)
+    except (ValueError, ZeroDivisionError, RecursionError, MemoryError):
+        return None
+
+    return result, tuple(operations)
+
+
+def drive_calculation(calculation: Generator[Any, Any, Optional[Number]],
+                      llm_client: LLMClientBase) -> Optional[Number]:
+    """
+    Run an agent's calculation generator to completion: send each prompt it yields to the LLM client
+    and send the response back in.
+
+    Args:
+        calculation: The generator returned by the agent's _calculation()
+        llm_client: The client answering the prompts
+
+    Returns:
+        The value returned by the generator
+    """
+    try:
+        prompt_msg = next(calculation)
+        while True:
+            prompt_msg = calculation.send(llm_client.run_prompt(prompt_msg))
+    except StopIteration as done:
+        return done.value
+
+
+async def adrive_calculation(calculation: Generator[Any, Any, Optional[Number]],
+                             llm_client: LLMClientBase) -> Optional[Number]:
+    """Asynchronous version of drive_calculation(): the LLM calls are awaited."""
+    try:
+        prompt_msg = next(calculation)
+        while True:
+            prompt_msg = calculation.send(await llm_client.arun_prompt(prompt_msg))
+    except StopIteration as done:
+        return done.value
@@ -31,6 +31,10 @@ class MessageHistory:
     def get_messages(self):
         return self.messages
 
+    def copy(self) -> 'MessageHistory':
+        """Return a new history holding the same messages; appending to it leaves this one unchanged."""
+        return MessageHistory(list(self.messages))
+
     # def __str__(self):
     #     return str(self.messages)
 
@@ -46,6 +50,8 @@ class ChatGPTError(Exception):
 class ChatGPTClient(LLMClientBase):
     def __init__(self, config: dict):
         self.client = openai.OpenAI(api_key=config['api_key'])
+        self._api_key: str = config['api_key']
+        self._async_client: Optional[openai.AsyncOpenAI] = None   # Created on first use by arun_prompt
 
         self.model: str = config['model']
         self.tool_definitions: List[Dict] = config['tool_definitions']
@@ -66,3 +72,22 @@ class ChatGPTClient(LLMClientBase):
 
         response = completion.choices[0].message
         return response
+
+    async def arun_prompt(self, msg_history: MessageHistory) -> Any:
+        if self._async_client is None:
+            self._async_client = openai.AsyncOpenAI(api_key=self._api_key)
+
+        try:
+            completion = await self._async_client.chat.completions.create(
+                model=self.model,
+                messages=msg_history.get_messages(),
+                tools=self.tool_definitions,
+                tool_choice=self.tool_call_required,
+            )
+        except openai.OpenAIError as e:
+            raise ChatGPTError(f"API error: {str(e)}") from e
+        except Exception as e:
+            raise ChatGPTError(f"Unexpected error: {str(e)}") from e
+
+        response = completion.choices[0].message
+        return response
@@ -1,3 +1,4 @@
+import asyncio
 from abc import ABC, abstractmethod
 
 
@@ -6,3 +7,7 @@ class LLMClientBase(ABC):
     def run_prompt(self, msg_history):
         """Abstract method that should be implemented by child classes to run a prompt."""
         pass
+
+    async def arun_prompt(self, msg_history):
+        """Run a prompt without blocking the event loop. Child classes with an async API should override this."""
+        return await asyncio.to_thread(self.run_prompt, msg_history)
@@ -1,33 +1,20 @@
 #!/usr/bin/env python3
 import sys
 import os
+import asyncio
+import logging
 import argparse
-from dotenv import load_dotenv
+from typing import List, TYPE_CHECKING
 
 # Add the project directory to the Python path
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
-from src.orchestrator import CalculatorOrchestrator
+# The orchestrator is imported in main(), once it is needed: it pulls in the OpenAI client, which is slow to import
+if TYPE_CHECKING:
+    from src.orchestrator import CalculatorOrchestrator
 
-
-# Read the API key directly from .env file or environment
-def get_api_key():
-    """Get the API key from the .env file or environment variables."""
-    # Try to load from .env file first
-    try:
-        with open('.env', 'r') as f:
-            for line in f:
-                if line.startswith('OPENAI_API_KEY='):
-                    return line.strip().split('=', 1)[1]
-    except Exception as e:
-        print(f"Error reading .env file: {e}")
-    
-    # If not found, try environment variables
-    for var_name in ['OPENAI_API_KEY', 'OPEN_AI_TOKEN_2', 'OPENAI_KEY', 'OPEN_AI_KEY']:
-        if var_name in os.environ:
-            return os.environ.get(var_name)
-    
-    return None
+# Maximum number of expressions calculated concurrently in batch mode, to stay within API rate limits
+BATCH_CONCURRENCY = 8
 
 
 def setup_parser() -> argparse.ArgumentParser:
@@ -61,6 +48,20 @@ def setup_parser() -> argparse.ArgumentParser:
         help="Run in interactive mode."
     )
     
+    parser.add_argument(
+        "--batch",
+        "-b",
+        metavar="FILE",
+        help="Calculate the expressions in FILE (one per line) concurrently."
+    )
+    
+    parser.add_argument(
+        "--quiet",
+        "-q",
+        action="store_true",
+        help="Only print the results, not the calculation steps."
+    )
+    
     parser.add_argument(
         "--api-key",
         "-k",
@@ -70,7 +71,7 @@ def setup_parser() -> argparse.ArgumentParser:
     return parser
 
 
-def interactive_mode(orchestrator: CalculatorOrchestrator) -> None:
+def interactive_mode(orchestrator: 'CalculatorOrchestrator') -> None:
     """Run the calculator in interactive mode."""
     print("Calculator Agent Interactive Mode")
     print("Enter 'exit' or 'quit' to exit")
@@ -106,14 +107,44 @@ def interactive_mode(orchestrator: CalculatorOrchestrator) -> None:
             break
 
 
+async def calculate_batch(orchestrator: 'CalculatorOrchestrator', expressions: List[str]) -> None:
+    """Calculate several expressions concurrently and print their results in input order."""
+    semaphore = asyncio.Semaphore(BATCH_CONCURRENCY)
+
+    async def calculate_one(expression: str):
+        async with semaphore:
+            return await orchestrator.acalculate(expression)
+
+    results = await asyncio.gather(*(calculate_one(expression) for expression in expressions),
+                                   return_exceptions=True)
+
+    for expression, result in zip(expressions, results):
+        if isinstance(result, Exception):
+            print(f"{expression}: Error: {result}")
+        else:
+            print(f"{expression} = {result}")
+
+
 def main() -> None:
     """Main entry point for the calculator application."""
-    # Load environment variables from .env file
-    load_dotenv()
-    
     # Parse command line arguments
     parser = setup_parser()
     args = parser.parse_args()
+
+    if not (args.batch or args.interactive or args.expression):
+        parser.print_help()
+        return
+
+    # The calculation steps are logged at INFO level by the src.* loggers (other libraries stay at WARNING)
+    logging.basicConfig(level=logging.WARNING, format="%(message)s", stream=sys.stdout)
+    logging.getLogger("src").setLevel(logging.WARNING if args.quiet else logging.INFO)
+
+    from dotenv import load_dotenv
+    from src.orchestrator import CalculatorOrchestrator
+    from src.utils.env import get_api_key
+
+    # Load environment variables from .env file
+    load_dotenv()
     
     # Get API key
     api_key = args.api_key or get_api_key()
@@ -126,14 +157,23 @@ def main() -> None:
         orchestrator = CalculatorOrchestrator(
             config_path=args.config,
             agent_type=args.agent,
-            api_key=api_key
+            api_key=api_key,
+            verbose=not args.batch   # The step traces of concurrent calculations would interleave
         )
     except Exception as e:
         print(f"Error initializing calculator: {e}")
         sys.exit(1)
     
     # Run in interactive mode or calculate single expression
-    if args.interactive:
+    if args.batch:
+        try:
+            with open(args.batch, 'r') as f:
+                expressions = [line.strip() for line in f if line.strip()]
+        except OSError as e:
+            print(f"Error reading batch file: {e}")
+            sys.exit(1)
+        asyncio.run(calculate_batch(orchestrator, expressions))
+    elif args.interactive:
         interactive_mode(orchestrator)
     elif args.expression:
         try:
@@ -142,8 +182,6 @@ def main() -> None:
         except Exception as e:
             print(f"Error: {e}")
             sys.exit(1)
-    else:
-        parser.print_help()
 
 
 if __name__ == "__main__":
@@ -1,10 +1,43 @@
 import os
+import copy
+import json
+import math
+import hashlib
+import logging
+import threading
 import yaml
-from typing import Dict, Any, Optional, Union, List
+from collections import OrderedDict
+import importlib
+from typing import Dict, Any, Optional, Union, List, Callable, Tuple, TYPE_CHECKING
 
-from src.llm.chatgpt import ChatGPTClient
-from src.agents.stepwise_agent import StepwiseCalculatorAgent
-from src.agents.reducing_agent import ReducingCalculatorAgent
+from src.agents.step_record import StepRecord
+from src.agents.utility import validate_expression, safe_eval, canonicalize
+from src.utils.env import get_api_key, API_KEY_ENV_VARS
+
+# The agents and the LLM client are imported when first used: the OpenAI client library is slow to import
+if TYPE_CHECKING:
+    from src.llm.chatgpt import ChatGPTClient
+    from src.agents.stepwise_agent import StepwiseCalculatorAgent
+    from src.agents.reducing_agent import ReducingCalculatorAgent
+
+logger = logging.getLogger(__name__)
+
+# Maximum number of results kept in the orchestrator's response cache
+RESPONSE_CACHE_SIZE = 1024
+
+# Parsed YAML files, keyed by path and modification time so that edited files are read again
+_yaml_cache: Dict[Tuple[str, float], Dict[str, Any]] = {}
+
+
+def _load_yaml(path: str) -> Dict[str, Any]:
+    """Load a YAML config file, parsing it only once per version. Callers get their own (deep) copy."""
+    key = (os.path.abspath(path), os.path.getmtime(path))
+    config = _yaml_cache.get(key)
+    if config is None:
+        with open(path, 'r') as f:
+            config = yaml.safe_load(f)
+        _yaml_cache[key] = config
+    return copy.deepcopy(config)
 
 
 class CalculatorOrchestrator:
@@ -13,20 +46,17 @@ class CalculatorOrchestrator:
     configuration loading, and provides a unified interface for calculations.
     """
     
+    # Agent type -> (module, class name), imported on demand by _create_agent()
     AGENT_TYPES = {
-        "stepwise": StepwiseCalculatorAgent,
-        "reducing": ReducingCalculatorAgent
+        "stepwise": ("src.agents.stepwise_agent", "StepwiseCalculatorAgent"),
+        "reducing": ("src.agents.reducing_agent", "ReducingCalculatorAgent")
     }
     
     # List of environment variable names to check for API key
-    API_KEY_ENV_VARS = [
-        "OPENAI_API_KEY",
-        "OPEN_AI_TOKEN_2",
-        "OPENAI_KEY",
-        "OPEN_AI_KEY"
-    ]
+    API_KEY_ENV_VARS = API_KEY_ENV_VARS
     
-    def __init__(self, config_path: Optional[str] = None, agent_type: str = "stepwise", api_key: Optional[str] = None) -> None:
+    def __init__(self, config_path: Optional[str] = None, agent_type: str = "stepwise", api_key: Optional[str] = None,
+                 verbose: bool = True) -> None:
         """
         Initialize the calculator orchestrator.
         
@@ -34,9 +64,19 @@ class CalculatorOrchestrator:
             config_path: Path to the configuration file. If None, will use default config for the agent type.
             agent_type: Type of agent to use ("stepwise" or "reducing").
             api_key: OpenAI API key. If provided, it will override the environment variable.
+            verbose: Whether the calculation steps are logged (at INFO level).
         """
         self.agent_type = agent_type.lower()
         self.api_key = api_key
+        self.verbose = verbose
+
+        # LLM clients by API key hash and client settings, so switching agents or configs reuses their connections
+        self._llm_client_cache: Dict[Tuple[str, str, str, str], 'ChatGPTClient'] = {}
+
+        # (agent type, canonical expression) -> (result, steps), least recently used first
+        self._response_cache: OrderedDict[Tuple[str, str], Tuple[float, List[StepRecord]]] = OrderedDict()
+        # The app shares one orchestrator between sessions, each running in its own thread
+        self._response_cache_lock = threading.Lock()
         
         if self.agent_type not in self.AGENT_TYPES:
             raise ValueError(f"Invalid agent type: {agent_type}. Must be one of {list(self.AGENT_TYPES.keys())}")
@@ -58,12 +98,9 @@ class CalculatorOrchestrator:
         if not os.path.exists(config_path):
             raise FileNotFoundError(f"Config file not found at {config_path}")
         
-        with open(config_path, 'r') as f:
-            config = yaml.safe_load(f)
-        
-        return config
+        return _load_yaml(config_path)
     
-    def _create_llm_client(self) -> ChatGPTClient:
+    def _create_llm_client(self) -> 'ChatGPTClient':
         """Create an LLM client with the loaded configuration."""
         # Set additional required config for ChatGPTClient
         self.config['tool_call_required'] = 'required'
@@ -71,36 +108,11 @@ class CalculatorOrchestrator:
         # Use directly provided API key if available
         if self.api_key:
             self.config['api_key'] = self.api_key
-            return ChatGPTClient(self.config)
+            return self._get_llm_client()
         
-        # Try to get API key from environment variable specified in config
-        api_key = None
+        # Try the environment variable specified in config, then the common names, then the .env file
         env_var = self.config.get('openai_key_env_var')
-        
-        if env_var:
-            api_key = os.environ.get(env_var)
-        
-        # If not found, try other common environment variable names
-        if not api_key:
-            for var_name in self.API_KEY_ENV_VARS:
-                if var_name in os.environ:
-                    api_key = os.environ.get(var_name)
-                    print(f"Using API key from environment variable: {var_name}")
-                    break
-        
-        # If still not found, try to read directly from .env file
-        if not api_key:
-            try:
-                with open('.env', 'r') as f:
-                    for line in f:
-                        if '=' in line:
-                            key, value = line.strip().split('=', 1)
-                            if key in self.API_KEY_ENV_VARS:
-                                api_key = value
-                                print(f"Using API key from .env file with key: {key}")
-                                break
-            except Exception as e:
-                print(f"Error reading .env file: {e}")
+        api_key = get_api_key(env_var)
         
         if not api_key:
             env_vars_tried = [env_var] if env_var else []
@@ -109,7 +121,22 @@ class CalculatorOrchestrator:
         
         self.config['api_key'] = api_key
         
-        return ChatGPTClient(self.config)
+        return self._get_llm_client()
+
+    def _get_llm_client(self) -> 'ChatGPTClient':
+        """Return a ChatGPTClient for the current configuration, reusing an existing one with the same settings."""
+        from src.llm.chatgpt import ChatGPTClient
+
+        key = (hashlib.sha256(self.config['api_key'].encode()).hexdigest(),
+               self.config['model'],
+               json.dumps(self.config['tool_definitions'], sort_keys=True),
+               self.config['tool_call_required'])
+
+        client = self._llm_client_cache.get(key)
+        if client is None:
+            client = ChatGPTClient(self.config)
+            self._llm_client_cache[key] = client
+        return client
     
     def _ensure_agent_config(self, agent_type: str) -> None:
         """Ensure that the configuration contains all required keys for the agent type."""
@@ -126,8 +153,7 @@ class CalculatorOrchestrator:
         if agent_type != self.agent_type or not required_keys[agent_type].issubset(config_keys):
             agent_config_path = f"config/{agent_type}_agent_config.yaml"
             if os.path.exists(agent_config_path):
-                with open(agent_config_path, 'r') as f:
-                    agent_config = yaml.safe_load(f)
+                agent_config = _load_yaml(agent_config_path)
                 
                 # Merge configs, keeping existing values like API key
                 for key, value in agent_config.items():
@@ -136,25 +162,122 @@ class CalculatorOrchestrator:
             else:
                 print(f"Warning: Config file for {agent_type} agent not found at {agent_config_path}")
     
-    def _create_agent(self) -> Union[StepwiseCalculatorAgent, ReducingCalculatorAgent]:
+    def _create_agent(self) -> Union['StepwiseCalculatorAgent', 'ReducingCalculatorAgent']:
         """Create an agent of the specified type."""
         # Ensure configuration has all required keys for this agent type
         self._ensure_agent_config(self.agent_type)
+        self.config['verbose'] = self.verbose
         
-        agent_class = self.AGENT_TYPES[self.agent_type]
+        module_name, class_name = self.AGENT_TYPES[self.agent_type]
+        agent_class = getattr(importlib.import_module(module_name), class_name)
         return agent_class(self.llm_client, self.config)
     
-    def calculate(self, expression: str) -> Optional[float]:
+    def calculate(self, expression: str,
+                  step_callback: Optional[Callable[[StepRecord], None]] = None,
+                  use_cache: bool = True) -> Optional[float]:
         """
         Calculate the result of a mathematical expression.
         
         Args:
             expression: The mathematical expression to evaluate.
+            step_callback: Optional callable that receives a StepRecord after each calculation step.
+            use_cache: If False, the response cache is skipped and the agent always runs.
             
         Returns:
             The result of the calculation, or None if calculation failed.
         """
-        return self.agent.run(expression)
+        result = self._calculate_without_agent(expression, step_callback, use_cache)
+        if result is not None:
+            return result
+
+        steps: List[StepRecord] = []
+        result = self.agent.run(expression, self._recording_callback(steps, step_callback))
+        self._cache_result(expression, result, steps)
+        return result
+
+    async def acalculate(self, expression: str,
+                         step_callback: Optional[Callable[[StepRecord], None]] = None,
+                         use_cache: bool = True) -> Optional[float]:
+        """
+        Asynchronous version of calculate(). The agent's LLM calls are awaited, so several expressions
+        can be calculated concurrently with asyncio.gather().
+        
+        Args:
+            expression: The mathematical expression to evaluate.
+            step_callback: Optional callable that receives a StepRecord after each calculation step.
+            use_cache: If False, the response cache is skipped and the agent always runs.
+            
+        Returns:
+            The result of the calculation, or None if calculation failed.
+        """
+        result = self._calculate_without_agent(expression, step_callback, use_cache)
+        if result is not None:
+            return result
+
+        steps: List[StepRecord] = []
+        result = await self.agent.arun(expression, self._recording_callback(steps, step_callback))
+        self._cache_result(expression, result, steps)
+        return result
+
+    def _calculate_without_agent(self, expression: str,
+                                 step_callback: Optional[Callable[[StepRecord], None]] = None,
+                                 use_cache: bool = True) -> Optional[float]:
+        """
+        Answer the expression locally or from the response cache if possible.
+        
+        Returns:
+            The result, or None if the agent has to calculate it.
+        """
+        # Invalid expressions will raise an exception, before they are parsed for the cache key
+        validate_expression(expression, self.config['max_expression_length'])
+
+        # Plain arithmetic doesn't need the LLM. Skipped when a step_callback asks for the agent's steps.
+        if step_callback is None and self.config.get('trust_safe_eval', True):
+            result = safe_eval(expression)
+            if result is not None and math.isfinite(result):
+                if self.verbose:
+                    logger.info(f"Evaluated locally: {expression} = {result}")
+                return float(result)
+
+        # Repeated expressions are answered from the cache, replaying the recorded steps
+        if not use_cache:
+            return None
+        key = (self.agent_type, canonicalize(expression))
+        with self._response_cache_lock:
+            cached = self._response_cache.get(key)
+            if cached is None:
+                return None
+            self._response_cache.move_to_end(key)
+
+        result, steps = cached
+        if self.verbose:
+            logger.info(f"Cached result: {expression} = {result}")
+        if step_callback is not None:
+            for step in steps:
+                step_callback(step)
+        return result
+
+    @staticmethod
+    def _recording_callback(steps: List[StepRecord],
+                            step_callback: Optional[Callable[[StepRecord], None]] = None) -> Callable[[StepRecord], None]:
+        """Return a step callback that records each step in steps before passing it on to step_callback."""
+        def record_step(step: StepRecord) -> None:
+            steps.append(step)
+            if step_callback is not None:
+                step_callback(step)
+
+        return record_step
+
+    def _cache_result(self, expression: str, result: Optional[float], steps: List[StepRecord]) -> None:
+        """Store a successful result in the response cache, evicting the least recently used entry if it is full."""
+        if result is None:
+            return
+
+        key = (self.agent_type, canonicalize(expression))
+        with self._response_cache_lock:
+            self._response_cache[key] = (result, steps)
+            if len(self._response_cache) > RESPONSE_CACHE_SIZE:
+                self._response_cache.popitem(last=False)
     
     def change_agent(self, agent_type: str, config_path: Optional[str] = None) -> None:
         """
@@ -172,6 +295,8 @@ class CalculatorOrchestrator:
         if config_path:
             self.config = self._load_config(config_path)
             self.llm_client = self._create_llm_client()
+            with self._response_cache_lock:
+                self._response_cache.clear()
         
         self.agent = self._create_agent()
     
@@ -184,4 +309,6 @@ class CalculatorOrchestrator:
         """
         self.config = self._load_config(config_path)
         self.llm_client = self._create_llm_client()
-        self.agent = self._create_agent() 
\ No newline at end of file
+        self.agent = self._create_agent()
+        with self._response_cache_lock:
+            self._response_cache.clear()
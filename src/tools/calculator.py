@@ -1,21 +1,23 @@
+import operator
 from typing import Union
 
 Number = Union[int, float]
 
+# Operator symbol -> function, so that calculate() dispatches with one dict lookup instead of a chain of comparisons.
+# Also used by the agents wherever they apply an operator themselves
+OPERATIONS = {'+': operator.add, '-': operator.sub, '*': operator.mul, '/': operator.truediv}
+
 
 def calculate(a: Number, b: Number, op: str) -> Number:
     # Clean up the operator string to handle potential spaces or formatting issues
     op = op.strip()
     
-    if op == '+':
-        return a + b
-    elif op == '-':
-        return a - b
-    elif op == '*':
-        return a * b
-    elif op == '/':
-        if b == 0:
-            raise ZeroDivisionError(f'Division by zero is not allowed. (a = {a}, b = 0)')
-        return a / b
-    else:
-        raise ValueError(f'Unsupported operation: "{op}". Supported operations are +, -, *, /.')
+    try:
+        operation = OPERATIONS[op]
+    except KeyError:
+        raise ValueError(f'Unsupported operation: "{op}". Supported operations are +, -, *, /.') from None
+
+    try:
+        return operation(a, b)
+    except ZeroDivisionError:
+        raise ZeroDivisionError(f'Division by zero is not allowed. (a = {a}, b = 0)') from None
@@ -0,0 +1,44 @@
+import os
+from typing import Dict, Optional, Tuple
+
+from dotenv import dotenv_values
+
+# Environment variable names that may hold the OpenAI API key, in order of preference
+API_KEY_ENV_VARS = ("OPENAI_API_KEY", "OPEN_AI_TOKEN_2", "OPENAI_KEY", "OPEN_AI_KEY")
+
+# Keys found so far, by (env_var, dotenv_path). Missing keys are not stored, so a key set later is still found
+_api_key_cache: Dict[Tuple[Optional[str], str], str] = {}
+
+
+def get_api_key(env_var: Optional[str] = None, dotenv_path: str = '.env') -> Optional[str]:
+    """
+    Get the OpenAI API key from the environment or the .env file. A key that was found is cached per process.
+
+    Args:
+        env_var: Optional environment variable name to check before API_KEY_ENV_VARS.
+        dotenv_path: Path of the .env file, read if none of the variables is set in the environment.
+
+    Returns:
+        The API key, or None if it was not found.
+    """
+    cache_key = (env_var, dotenv_path)
+    api_key = _api_key_cache.get(cache_key)
+    if api_key is not None:
+        return api_key
+
+    var_names = ((env_var,) if env_var else ()) + API_KEY_ENV_VARS
+
+    for var_name in var_names:
+        value = os.environ.get(var_name)
+        if value:
+            _api_key_cache[cache_key] = value
+            return value
+
+    dotenv = dotenv_values(dotenv_path)
+    for var_name in var_names:
+        value = dotenv.get(var_name)
+        if value:
+            _api_key_cache[cache_key] = value
+            return value
+
+    return None
@@ -0,0 +1,17 @@
+import io
+import sys
+
+
+def buffer_stdout(interactive: bool = False) -> None:
+    """
+    Replace sys.stdout with a buffered writer so that the per-step output is written in large chunks
+    instead of one write per line. Interactive mode stays line buffered so prompts show up immediately.
+    """
+    try:
+        fileno = sys.stdout.fileno()
+    except (AttributeError, io.UnsupportedOperation):
+        return  # stdout is not backed by a file (e.g. captured), leave it alone
+
+    sys.stdout.flush()
+    sys.stdout = open(fileno, 'w', buffering=1 if interactive else 64 * 1024,
+                      encoding=sys.stdout.encoding, errors=sys.stdout.errors, closefd=False)
@@ -0,0 +1,170 @@
+import json
+import asyncio
+import threading
+from types import SimpleNamespace
+
+import pytest
+
+from src.llm.llm_base import LLMClientBase
+from src.orchestrator import CalculatorOrchestrator
+
+
+class StubLLMClient(LLMClientBase):
+    """Answers each prompt with one calculate tool call from a script, repeating the script when it runs out."""
+
+    def __init__(self, operations):
+        self.operations = operations
+        self.calls = 0
+
+    def run_prompt(self, msg_history):
+        a, op, b = self.operations[self.calls % len(self.operations)]
+        self.calls += 1
+        is_final_step = self.calls % len(self.operations) == 0
+        arguments = json.dumps({"a": a, "b": b, "op": op, "is_final_step": is_final_step})
+        tool_call = SimpleNamespace(id=f"call_{self.calls}", type="function",
+                                    function=SimpleNamespace(name="calculate", arguments=arguments))
+        return SimpleNamespace(tool_calls=[tool_call], content=None, role="assistant")
+
+
+@pytest.fixture
+def stub_client():
+    return StubLLMClient([(5, '*', 3), (10, '+', 15)])
+
+
+class ExpressionStubLLMClient(StubLLMClient):
+    """Follows a separate script per expression, so that several calculations can run concurrently."""
+
+    def __init__(self, scripts):
+        self.scripts = {expression: StubLLMClient(operations) for expression, operations in scripts.items()}
+        self.lock = threading.Lock()   # arun_prompt() runs run_prompt() in worker threads
+
+    def run_prompt(self, msg_history):
+        first_prompt = msg_history.get_messages()[1]['content']
+        expression = next(expression for expression in self.scripts if expression in first_prompt)
+        with self.lock:
+            return self.scripts[expression].run_prompt(msg_history)
+
+
+def create_orchestrator(llm_client, trust_safe_eval=False):
+    """Create an orchestrator whose agent calls the given client instead of the OpenAI API."""
+    orchestrator = CalculatorOrchestrator(agent_type="stepwise", api_key="sk-test", verbose=False)
+    orchestrator.config['trust_safe_eval'] = trust_safe_eval
+    orchestrator.llm_client = llm_client
+    orchestrator.agent = orchestrator._create_agent()
+    return orchestrator
+
+
+@pytest.fixture
+def orchestrator(stub_client):
+    return create_orchestrator(stub_client)
+
+
+def test_plain_arithmetic_is_evaluated_locally(stub_client):
+    orchestrator = create_orchestrator(stub_client, trust_safe_eval=True)
+
+    assert orchestrator.calculate("10 + 5 * 3") == 25
+    assert stub_client.calls == 0
+
+
+def test_expression_not_evaluated_locally_falls_through_to_agent():
+    stub_client = StubLLMClient([(3, '+', 1), (2, '*', 4)])
+    orchestrator = create_orchestrator(stub_client, trust_safe_eval=True)
+
+    assert orchestrator.calculate("2(3 + 1)") == 8
+    assert stub_client.calls == 2
+
+
+def test_untrusted_local_evaluation_falls_through_to_agent(orchestrator, stub_client):
+    assert orchestrator.calculate("10 + 5 * 3") == 25
+    assert stub_client.calls == 2
+
+
+def test_force_recompute_skips_cache(orchestrator, stub_client):
+    steps = []
+    assert orchestrator.calculate("10 + 5 * 3", step_callback=steps.append) == 25
+    assert stub_client.calls == 2
+
+    recomputed_steps = []
+    assert orchestrator.calculate("10 + 5 * 3", step_callback=recomputed_steps.append, use_cache=False) == 25
+    assert stub_client.calls == 4
+    assert [step.call_steps for step in recomputed_steps] == [step.call_steps for step in steps]
+
+
+def test_result_differing_from_local_evaluation_is_not_cached():
+    stub_client = StubLLMClient([(5, '*', 3), (10, '+', 16)])
+    orchestrator = create_orchestrator(stub_client)
+
+    with pytest.raises(RuntimeError, match="differs from the local evaluation"):
+        orchestrator.calculate("10 + 5 * 3", step_callback=lambda step: None)
+    assert len(orchestrator._response_cache) == 0
+
+
+def test_cache_hit_after_canonicalization(orchestrator, stub_client):
+    assert orchestrator.calculate("10+5*3", step_callback=lambda step: None) == 25
+    assert orchestrator.calculate("(10) + (5 * 3)", step_callback=lambda step: None) == 25
+    assert stub_client.calls == 2
+
+
+def test_cache_hit_replays_steps(orchestrator, stub_client):
+    steps = []
+    orchestrator.calculate("10 + 5 * 3", step_callback=steps.append)
+
+    replayed_steps = []
+    assert orchestrator.calculate("10 + 5 * 3", step_callback=replayed_steps.append) == 25
+    assert stub_client.calls == 2
+    assert replayed_steps == steps
+
+
+def test_cache_evicts_least_recently_used(orchestrator, monkeypatch):
+    monkeypatch.setattr("src.orchestrator.RESPONSE_CACHE_SIZE", 2)
+    orchestrator.agent = SimpleNamespace(run=lambda expression, step_callback: 1.0)
+
+    for expression in ["1 + 1", "2 + 2", "1 + 1", "3 + 3"]:
+        orchestrator.calculate(expression, step_callback=lambda step: None)
+
+    # "1 + 1" was used again after "2 + 2", so "2 + 2" is the one evicted
+    assert list(orchestrator._response_cache) == [("stepwise", "1 + 1"), ("stepwise", "3 + 3")]
+
+
+def test_none_result_is_not_cached(orchestrator):
+    orchestrator.agent = SimpleNamespace(run=lambda expression, step_callback: None)
+
+    assert orchestrator.calculate("10 + 5 * 3", step_callback=lambda step: None) is None
+    assert len(orchestrator._response_cache) == 0
+
+
+@pytest.mark.parametrize("step_callback", [None, lambda step: None])
+def test_too_long_expression_is_rejected(orchestrator, step_callback):
+    with pytest.raises(ValueError, match="Expression exceeds maximum length"):
+        orchestrator.calculate("1+" * 400 + "1", step_callback=step_callback)
+
+
+BATCH_SCRIPTS = {
+    "10 + 5 * 3": [(5, '*', 3), (10, '+', 15)],
+    "2 * 3 + 1": [(2, '*', 3), (6, '+', 1)],
+    "8 / 2 - 1": [(8, '/', 2), (4, '-', 1)],
+}
+
+
+def test_acalculate_runs_concurrently():
+    orchestrator = create_orchestrator(ExpressionStubLLMClient(BATCH_SCRIPTS))
+    steps = {expression: [] for expression in BATCH_SCRIPTS}
+
+    async def calculate_all():
+        return await asyncio.gather(*(orchestrator.acalculate(expression, step_callback=steps[expression].append)
+                                      for expression in BATCH_SCRIPTS))
+
+    assert asyncio.run(calculate_all()) == [25, 7, 3]
+    assert [step.call_steps for step in steps["2 * 3 + 1"]] == [["2 * 3 = 6"], ["6 + 1 = 7"]]
+
+
+def test_calculate_batch_reports_errors_in_order(capsys):
+    from src.main import calculate_batch
+
+    orchestrator = create_orchestrator(ExpressionStubLLMClient(BATCH_SCRIPTS))
+    asyncio.run(calculate_batch(orchestrator, ["10 + 5 * 3", "2 + a", "8 / 2 - 1"]))
+
+    lines = capsys.readouterr().out.splitlines()
+    assert lines[0] == "10 + 5 * 3 = 25"
+    assert lines[1].startswith("2 + a: Error: Invalid characters in the expression")
+    assert lines[2] == "8 / 2 - 1 = 3"
@@ -7,25 +7,7 @@ from dotenv import load_dotenv
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 
 from src.orchestrator import CalculatorOrchestrator
-
-# Read the API key directly from .env file
-def get_api_key():
-    """Get the API key from the .env file or environment variables."""
-    # Try to load from .env file first
-    try:
-        with open('.env', 'r') as f:
-            for line in f:
-                if line.startswith('OPENAI_API_KEY='):
-                    return line.strip().split('=', 1)[1]
-    except Exception as e:
-        print(f"Error reading .env file: {e}")
-    
-    # If not found, try environment variables
-    for var_name in ['OPENAI_API_KEY', 'OPEN_AI_TOKEN_2', 'OPENAI_KEY', 'OPEN_AI_KEY']:
-        if var_name in os.environ:
-            return os.environ.get(var_name)
-    
-    return None
+from src.utils.env import get_api_key
 
 # Get the API key
 API_KEY = get_api_key()
@@ -34,6 +16,14 @@ if not API_KEY:
     sys.exit(1)
 
 
+def create_orchestrator(agent_type):
+    """Create an orchestrator whose calculations always go through the agent's LLM calls."""
+    orchestrator = CalculatorOrchestrator(agent_type=agent_type, api_key=API_KEY)
+    orchestrator.config['trust_safe_eval'] = False
+    orchestrator.agent = orchestrator._create_agent()
+    return orchestrator
+
+
 def test_both_agents_with_same_expression():
     """Test both agents with the same expression and compare results."""
     # Set up test expression
@@ -41,7 +31,7 @@ def test_both_agents_with_same_expression():
     expected_result = 21.0  # (10 + 15 - 4) = 21
     
     # Create orchestrator with stepwise agent
-    orchestrator = CalculatorOrchestrator(agent_type="stepwise", api_key=API_KEY)
+    orchestrator = create_orchestrator("stepwise")
     
     # Calculate with stepwise agent
     stepwise_result = orchestrator.calculate(expression)
@@ -50,8 +40,9 @@ def test_both_agents_with_same_expression():
     # Verify stepwise result
     assert stepwise_result == expected_result, f"Expected {expected_result}, got {stepwise_result}"
     
-    # Switch to reducing agent
+    # Switch to reducing agent (trust_safe_eval is kept from the current config)
     orchestrator.change_agent("reducing")
+    assert orchestrator.agent.trust_safe_eval is False
     
     # Calculate with reducing agent
     reducing_result = orchestrator.calculate(expression)
@@ -65,7 +56,7 @@ def test_both_agents_with_same_expression():
 
 def test_agent_switching():
     """Test switching between agents."""
-    orchestrator = CalculatorOrchestrator(agent_type="stepwise", api_key=API_KEY)
+    orchestrator = create_orchestrator("stepwise")
     assert orchestrator.agent_type == "stepwise"
     
     orchestrator.change_agent("reducing")
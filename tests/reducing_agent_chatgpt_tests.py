@@ -20,6 +20,7 @@ def agent():
 
     config['tool_call_required'] = 'required'
     config['max_calls'] = 5
+    config['trust_safe_eval'] = False   # Exercise the LLM, not the local evaluator
 
     return ReducingCalculatorAgent(llm_client, config)
 
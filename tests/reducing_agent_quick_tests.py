@@ -18,6 +18,7 @@ config = yaml.safe_load(open(config_file))
 
 config['tool_call_required'] = 'required'
 config['api_key'] = os.environ.get(config['openai_key_env_var'])
+config['trust_safe_eval'] = False
 llm_client = ChatGPTClient(config)
 
 
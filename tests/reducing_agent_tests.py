@@ -0,0 +1,69 @@
+import json
+from types import SimpleNamespace
+
+import pytest
+import yaml
+
+from src.agents.reducing_agent import _reduce_parens, ReducingCalculatorAgent
+from src.llm.llm_base import LLMClientBase
+
+
+class OneStepLLMClient(LLMClientBase):
+    """Always answers with the same, non-final calculate tool call."""
+
+    def __init__(self, a, op, b):
+        self.arguments = json.dumps({"a": a, "b": b, "op": op, "is_final_step": False})
+
+    def run_prompt(self, msg_history):
+        function = SimpleNamespace(name="calculate", arguments=self.arguments)
+        return SimpleNamespace(tool_calls=[SimpleNamespace(id="call_1", type="function", function=function)])
+
+
+def create_agent(llm_client, max_llm_calls):
+    with open('config/reducing_agent_config.yaml') as f:
+        config = yaml.safe_load(f)
+    config.update(trust_safe_eval=False, max_llm_calls=max_llm_calls, verbose=False)
+    return ReducingCalculatorAgent(llm_client, config)
+
+
+@pytest.mark.parametrize("expression, expected_expression, expected_steps", [
+    ("(3 + 2)", "5", ["(3 + 2) = 5"]),
+    ("((1 + 2) * 3)", "9", ["(1 + 2) = 3", "(3 * 3) = 9"]),
+    ("(1 + 2) * 3 + (4)", "3 * 3 + 4", ["(1 + 2) = 3"]),
+    ("10 - (2 * (3 + 1))", "10 - 8", ["(3 + 1) = 4", "(2 * 4) = 8"]),
+    ("2 + 3", "2 + 3", []),
+    ("(1 - 3) ** 2", "(-2) ** 2", ["(1 - 3) = -2"]),
+    ("5 - (1 - 3)", "5 - (-2)", ["(1 - 3) = -2"]),
+    ("(1 - 3)", "(-2)", ["(1 - 3) = -2"]),
+])
+def test_reduce_parens_innermost_first(expression, expected_expression, expected_steps):
+    assert _reduce_parens(expression) == (expected_expression, expected_steps)
+
+
+@pytest.mark.parametrize("expression, expected_expression, expected_steps", [
+    ("2(3+1)", "2(3+1)", []),
+    ("(2)(3)", "(2)(3)", []),
+    ("(3 + 1)2", "(3 + 1)2", []),
+    ("((1 + 2) * 3) + 2(4)", "9 + 2(4)", ["(1 + 2) = 3", "(3 * 3) = 9"]),
+])
+def test_reduce_parens_keeps_implicit_multiplication(expression, expected_expression, expected_steps):
+    assert _reduce_parens(expression) == (expected_expression, expected_steps)
+
+
+@pytest.mark.parametrize("expression, expected_expression, expected_steps", [
+    ("(4 / 0)", "(4 / 0)", []),
+    ("(2 + 3) * (4 / (1 - 1))", "5 * (4 / 0)", ["(2 + 3) = 5", "(1 - 1) = 0"]),
+])
+def test_reduce_parens_leaves_division_by_zero(expression, expected_expression, expected_steps):
+    assert _reduce_parens(expression) == (expected_expression, expected_steps)
+
+
+def test_max_llm_calls_falls_back_to_local_evaluation():
+    agent = create_agent(OneStepLLMClient(5, '*', 3), max_llm_calls=1)
+    assert agent.run("10 + 5 * 3") == 25
+
+
+def test_max_llm_calls_without_local_evaluation_raises():
+    agent = create_agent(OneStepLLMClient(5, '*', 3), max_llm_calls=1)
+    with pytest.raises(RuntimeError, match="Max LLM calls reached"):
+        agent.run("10 + 5 * 3 ** 2")
@@ -19,6 +19,7 @@ def create_agent(config_overrides=None):
 
     config['tool_call_required'] = 'required'
     config['max_calls'] = 5
+    config['trust_safe_eval'] = False   # Exercise the LLM, not the local evaluator
 
     if config_overrides:
         config.update(config_overrides)
@@ -1,6 +1,7 @@
 import pytest
 
-from src.agents.utility import validate_expression
+from src.agents.utility import validate_expression, evaluate_locally, safe_eval, canonicalize, \
+    parse_tool_call_arguments, reduce_expression
 
 
 @pytest.mark.parametrize("expression, error_type, error_message", [
@@ -26,3 +27,77 @@ def test_too_long_expression():
         validate_expression(expression, max_expression_length=10)
 
     assert 'Expression exceeds maximum length' in str(excinfo.value)
+
+
+@pytest.mark.parametrize("expression, expected_result, expected_ops", [
+    ("2 + 3", 5, [(2, '+', 3, 5)]),
+    ("10 + 5 * 3 - 8 / 2", 21, [(5, '*', 3, 15), (10, '+', 15, 25), (8, '/', 2, 4), (25, '-', 4, 21)]),
+    ("(3 + 2) * 4", 20, [(3, '+', 2, 5), (5, '*', 4, 20)]),
+    ("-5 * 3", -15, [(-5, '*', 3, -15)]),
+    ("42", 42, []),
+])
+def test_evaluate_locally(expression, expected_result, expected_ops):
+    result, operations = evaluate_locally(expression)
+    assert result == pytest.approx(expected_result)
+    assert list(operations) == expected_ops
+
+
+@pytest.mark.parametrize("expression", ["2 ** 3", "1 / 0", "abs(-1)", "3 +", "True + 1",
+                                        "1+" * 3000 + "1", "-" * 3000 + "1"])
+def test_evaluate_locally_rejects(expression):
+    assert evaluate_locally(expression) is None
+
+
+@pytest.mark.parametrize("expression, expected_result", [
+    ("2 + 2", 4),
+    ("-(3 - 5) * 2.5", 5.0),
+    ("2 ** 3", None),
+    ("__import__('os')", None),
+    ("1 / (2 - 2)", None),
+])
+def test_safe_eval(expression, expected_result):
+    assert safe_eval(expression) == expected_result
+
+
+@pytest.mark.parametrize("expression, expected", [
+    ("10+5*3", "10 + 5 * 3"),
+    ("(10) + (5 * 3)", "10 + 5 * 3"),
+    ("(10 + 5) * 3", "(10 + 5) * 3"),
+    ("3 * 2", "3 * 2"),
+    ("007 + 1", "007+1"),
+    ("1 + " * 400 + "1", "1+" * 400 + "1"),
+])
+def test_canonicalize(expression, expected):
+    assert canonicalize(expression) == expected
+
+
+@pytest.mark.parametrize("expression, operation, expected", [
+    ("2 * (10 + 5) - 12 / 3", (10, 5, '+', 15), "2 * 15 - 12 / 3"),
+    ("10 + 5 * 3 - 8 / 2", (5, 3, '*', 15), "10 + 15 - 8 / 2"),
+    ("2.50 * 4", (2.5, 4, '*', 10.0), "10"),
+    ("10 - (3 - 5)", (3, 5, '-', -2), "10 - -2"),
+    ("2 + 3 + 2 + 3", (2, 3, '+', 5), "5 + 2 + 3"),
+    ("2 * 3 * 4", (3, 4, '*', 12), "2 * 12"),   # Not an operation of the parsed expression: text fallback
+])
+def test_reduce_expression(expression, operation, expected):
+    assert reduce_expression(expression, *operation) == expected
+
+
+@pytest.mark.parametrize("arguments, expected", [
+    ('{"a": 5, "b": 3, "op": "*", "is_final_step": false}', (5, 3, '*', False)),
+    ('{"a": 25, "b": 4.0, "op:": "-", "is_final_step": true}', (25, 4.0, '-', True)),
+    ('{"a": 1, "b": 2, "op:" : "+", "is_final_step": false}', (1, 2, '+', False)),
+])
+def test_parse_tool_call_arguments(arguments, expected):
+    assert parse_tool_call_arguments(arguments) == expected
+
+
+@pytest.mark.parametrize("arguments, error_type", [
+    ('{"a": 5, "b": 3, "is_final_step": false}', RuntimeError),
+    ('not json', RuntimeError),
+    ('{"a": 5, "b": 3, "op": "^", "is_final_step": false}', ValueError),
+    ('{"a": 5, "b": 3, "op": 1, "is_final_step": false}', ValueError),
+])
+def test_parse_tool_call_arguments_invalid(arguments, error_type):
+    with pytest.raises(error_type):
+        parse_tool_call_arguments(arguments)